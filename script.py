@@ -1,12 +1,28 @@
+import io
 import os
 import sys
 import json
-import shutil
 import zipfile
 import tarfile
-import gzip
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from typing import NamedTuple
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    # ISA-L accelerated inflate, drop-in replacement for gzip
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configuration URLs
 FFMPEG_URL = "https://github.com/eugeneware/ffmpeg-static/releases/download/b6.1.1"
@@ -16,16 +32,69 @@ MEGATOOLS_URL = "https://megatools.megous.com/builds/builds"
 BENTO4_VERSION = "1-6-0-641"
 MEGATOOLS_VERSION = "1.11.3.20250401"
 
+# Per-target lookup tables keyed by (platform, arch):
+# (url segment, archive extension, executable suffix, executable names)
+BENTO4_EXECUTABLES = ('mp4decrypt', 'mp4encrypt', 'mp4info', 'mp4dump')
+
+FFMPEG_TARGETS = {
+    ('windows', 'x64'): ('win32-x64', '.gz', '.exe', ('ffmpeg', 'ffprobe')),
+    ('darwin', 'x64'): ('darwin-x64', '.gz', '', ('ffmpeg', 'ffprobe')),
+    ('darwin', 'arm64'): ('darwin-arm64', '.gz', '', ('ffmpeg', 'ffprobe')),
+    ('linux', 'x64'): ('linux-x64', '.gz', '', ('ffmpeg', 'ffprobe')),
+    ('linux', 'arm64'): ('linux-arm64', '.gz', '', ('ffmpeg', 'ffprobe')),
+}
+
+BENTO4_TARGETS = {
+    ('windows', 'x64'): ('x86_64-microsoft-win32', '.zip', '.exe', BENTO4_EXECUTABLES),
+    ('darwin', 'x64'): ('universal-apple-macosx', '.zip', '', BENTO4_EXECUTABLES),
+    ('darwin', 'arm64'): ('universal-apple-macosx', '.zip', '', BENTO4_EXECUTABLES),
+    ('linux', 'x64'): ('x86_64-unknown-linux', '.zip', '', BENTO4_EXECUTABLES),
+    ('linux', 'arm64'): ('x86_64-unknown-linux', '.zip', '', BENTO4_EXECUTABLES),
+}
+
+MEGATOOLS_TARGETS = {
+    ('windows', 'x64'): ('win64', '.zip', '.exe', ('megatools',)),
+    ('darwin', 'x64'): ('linux-x86_64', '.tar.gz', '', ('megatools',)),
+    ('darwin', 'arm64'): ('linux-aarch64', '.tar.gz', '', ('megatools',)),
+    ('linux', 'x64'): ('linux-x86_64', '.tar.gz', '', ('megatools',)),
+    ('linux', 'arm64'): ('linux-aarch64', '.tar.gz', '', ('megatools',)),
+}
+
+# Concurrent downloads
+MAX_WORKERS = 8
+
+# Buffer size for HTTP reads, file writes and streamed copies
+CHUNK_SIZE = 1 << 20
+
+
+class Target(NamedTuple):
+    # One download and the executables it provides for a platform/arch
+    tool: str
+    platform: str
+    arch: str
+    url: str
+    extension: str
+    exe_suffix: str
+    executables: tuple
+
 
 class BinaryDownloader:
     def __init__(self, base_path: str = "./binaries"):
         self.base_path = Path(base_path)
-        self.paths_json = {}
+        self.paths_json = defaultdict(set)
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         })
         
+        # Keep the per-host connection pool in line with the worker count
+        adapter = HTTPAdapter(pool_maxsize=MAX_WORKERS)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # Set on Ctrl-C so worker threads abandon their downloads
+        self._stop = threading.Event()
+        
         self.platforms = {
             'windows': ['x64'],
             'darwin': ['x64', 'arm64'],
@@ -35,222 +104,333 @@ class BinaryDownloader:
         self._create_directories()
 
     def _create_directories(self):
-        for platform_name, arches in self.platforms.items():
-            for arch in arches:
-                (self.base_path / platform_name / arch / "ffmpeg").mkdir(parents=True, exist_ok=True)
-                (self.base_path / platform_name / arch / "bento4").mkdir(parents=True, exist_ok=True)
-                (self.base_path / platform_name / arch / "megatools").mkdir(parents=True, exist_ok=True)
+        leaf_dirs = [
+            self.base_path / platform_name / arch / tool
+            for platform_name, arches in self.platforms.items()
+            for arch in arches
+            for tool in ('ffmpeg', 'bento4', 'megatools')
+        ]
+        
+        for directory in leaf_dirs:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _open_binary(path: Path, exe_suffix: str):
+        # Create with the final mode up front instead of a chmod afterwards;
+        # the mode only applies on creation, so never reuse an existing file
+        mode = 0o666 if exe_suffix else 0o755
+        path.unlink(missing_ok=True)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+        return os.fdopen(os.open(path, flags, mode), 'wb', buffering=CHUNK_SIZE)
+
+    @contextmanager
+    def _write_binary(self, dest: Path, exe_suffix: str):
+        # Write beside the destination and move into place only once complete,
+        # so an interrupted or failed write never leaves a "cached" partial file
+        part = dest.with_name(dest.name + '.part')
+        try:
+            with self._open_binary(part, exe_suffix) as f:
+                yield f
+            os.replace(part, dest)
+        except BaseException:
+            part.unlink(missing_ok=True)
+            raise
 
-    def _download(self, url: str, dest: Path) -> bool:
+    def _download(self, url: str, dest: Path, exe_suffix: str, transform, errors: list) -> bool:
         try:
             response = self.session.get(url, stream=True, timeout=60)
             response.raise_for_status()
             
-            with open(dest, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            with self._write_binary(dest, exe_suffix) as f:
+                # Hand the undecoded socket stream straight to the transform,
+                # buffered so it is read in CHUNK_SIZE pieces rather than at
+                # the decompressor's own small read size
+                response.raw.decode_content = False
+                transform(io.BufferedReader(response.raw, buffer_size=CHUNK_SIZE), f)
             
             return True
         except Exception as e:
-            print(f"  X {url.split('/')[-1]}: {str(e)[:50]}")
+            errors.append(f"{url.split('/')[-1]}: {str(e)[:50]}")
             return False
 
+    def _fetch(self, url: str, errors: list):
+        # Zip needs its central directory at the end, so buffer in memory
+        try:
+            response = self.session.get(url, stream=True, timeout=60)
+            response.raise_for_status()
+            
+            buffer = io.BytesIO()
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                self._check_stop()
+                buffer.write(chunk)
+            
+            return buffer
+        except Exception as e:
+            errors.append(f"{url.split('/')[-1]}: {str(e)[:50]}")
+            return None
+
+    def _check_stop(self):
+        # SIGINT only reaches the main thread, so workers poll for it
+        if self._stop.is_set():
+            raise InterruptedError("interrupted")
+
+    def _copy(self, src, dst):
+        while True:
+            self._check_stop()
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+
+    def _gunzip(self, src, dst):
+        with gzip.GzipFile(fileobj=src) as gz:
+            self._copy(gz, dst)
+
+    def _untar_member(self, src, dst, name: str):
+        # Stream mode: copy the one member we need and stop reading
+        with tarfile.open(fileobj=src, mode='r|gz') as tar:
+            for member in tar:
+                if member.isfile() and Path(member.name).name == name:
+                    self._copy(tar.extractfile(member), dst)
+                    return
+        
+        raise FileNotFoundError(f"{name} not in archive")
+
+    @staticmethod
+    def _cached(path: Path) -> bool:
+        return path.exists() and path.stat().st_size > 0
+
     def _add_path(self, platform: str, arch: str, tool: str, binary: str):
         key = f"{platform}_{arch}_{tool}"
-        if key not in self.paths_json:
-            self.paths_json[key] = []
-        
-        rel_path = f"{platform}/{arch}/{tool}/{binary}"
-        if rel_path not in self.paths_json[key]:
-            self.paths_json[key].append(rel_path)
+        self.paths_json[key].add(f"{platform}/{arch}/{tool}/{binary}")
+
+    @staticmethod
+    def _ffmpeg_url(name: str, platform_str: str, extension: str) -> str:
+        return f"{FFMPEG_URL}/{name}-{platform_str}{extension}"
 
-    def download_ffmpeg(self):
-        print("\n=== FFmpeg ===")
+    @staticmethod
+    def _bento4_url(platform_str: str, extension: str) -> str:
+        return f"{BENTO4_URL}/Bento4-SDK-{BENTO4_VERSION}.{platform_str}{extension}"
+
+    @staticmethod
+    def _megatools_url(platform_str: str, extension: str) -> str:
+        return f"{MEGATOOLS_URL}/megatools-{MEGATOOLS_VERSION}-{platform_str}{extension}"
+
+    def download_ffmpeg(self, target: Target):
+        errors = []
+        dest = self._target_dir(target) / target.executables[0]
         
-        # FFmpeg mapping
-        ffmpeg_map = {
-            'windows': {'x64': 'win32-x64'},
-            'darwin': {'x64': 'darwin-x64', 'arm64': 'darwin-arm64'},
-            'linux': {'x64': 'linux-x64', 'arm64': 'linux-arm64'}
-        }
+        if self._download(target.url, dest, target.exe_suffix, transform=self._gunzip, errors=errors):
+            return list(target.executables), errors
         
-        for platform_name, arches in self.platforms.items():
-            for arch in arches:
-                print(f"{platform_name}-{arch}: ", end="", flush=True)
-                
-                platform_str = ffmpeg_map[platform_name].get(arch)
-                if not platform_str:
-                    print("skip")
-                    continue
-                
-                target_dir = self.base_path / platform_name / arch / "ffmpeg"
-                success = 0
-                
-                for executable in ['ffmpeg', 'ffprobe']:
-                    filename = f"{executable}-{platform_str}"
-                    url = f"{FFMPEG_URL}/{filename}.gz"
-                    gz_path = target_dir / f"{filename}.gz"
+        return [], errors
+
+    def download_bento4(self, target: Target, buffer: io.BytesIO):
+        target_dir = self._target_dir(target)
+        errors = []
+        binaries = []
+        try:
+            with zipfile.ZipFile(buffer, 'r') as zip_ref:
+                wanted = set(target.executables)
+                for zip_info in zip_ref.infolist():
+                    executable = zip_info.filename.rsplit('/', 1)[-1]
+                    if executable not in wanted:
+                        continue
                     
-                    ext = ".exe" if platform_name == "windows" else ""
-                    final_path = target_dir / f"{executable}{ext}"
+                    dst = target_dir / executable
                     
-                    if self._download(url, gz_path):
-                        try:
-                            with gzip.open(gz_path, 'rb') as f_in:
-                                with open(final_path, 'wb') as f_out:
-                                    shutil.copyfileobj(f_in, f_out)
-                            
-                            gz_path.unlink()
-                            
-                            if platform_name != "windows":
-                                os.chmod(final_path, 0o755)
-                            
-                            self._add_path(platform_name, arch, "ffmpeg", f"{executable}{ext}")
-                            success += 1
-                        except Exception as e:
-                            print(f"  X extract {executable}")
-                
-                print(f"{success}/2")
-
-    def download_bento4(self):
-        print("\n=== Bento4 ===")
+                    with zip_ref.open(zip_info) as src, self._write_binary(dst, target.exe_suffix) as f:
+                        self._copy(src, f)
+                    
+                    binaries.append(executable)
+                    wanted.discard(executable)
+                    if not wanted:
+                        break
+        except Exception as e:
+            errors.append(f"extract: {str(e)[:40]}")
         
-        platform_config = {
-            'windows': {'x64': 'x86_64-microsoft-win32'},
-            'darwin': {'x64': 'universal-apple-macosx', 'arm64': 'universal-apple-macosx'},
-            'linux': {'x64': 'x86_64-unknown-linux', 'arm64': 'x86_64-unknown-linux'}
-        }
+        return binaries, errors
+
+    def download_megatools(self, target: Target, buffer: io.BytesIO):
+        (executable,) = target.executables
+        dst = self._target_dir(target) / executable
+        errors = []
         
-        executables = {
-            'windows': ['mp4decrypt.exe', 'mp4encrypt.exe', 'mp4info.exe', 'mp4dump.exe'],
-            'darwin': ['mp4decrypt', 'mp4encrypt', 'mp4info', 'mp4dump'],
-            'linux': ['mp4decrypt', 'mp4encrypt', 'mp4info', 'mp4dump']
-        }
+        if target.extension == '.tar.gz':
+            try:
+                with self._write_binary(dst, target.exe_suffix) as f:
+                    self._untar_member(buffer, f, name=executable)
+            except Exception as e:
+                errors.append(f"extract: {str(e)[:40]}")
+                return [], errors
+            
+            return [executable], errors
         
-        for platform_name, arches in self.platforms.items():
-            for arch in arches:
-                print(f"{platform_name}-{arch}: ", end="", flush=True)
-                
-                platform_str = platform_config[platform_name].get(arch)
-                if not platform_str:
-                    print("skip")
-                    continue
-                
-                url = f"{BENTO4_URL}/Bento4-SDK-{BENTO4_VERSION}.{platform_str}.zip"
-                
-                target_dir = self.base_path / platform_name / arch / "bento4"
-                zip_path = target_dir / "bento4.zip"
-                
-                if not self._download(url, zip_path):
-                    print("0/4")
-                    continue
-                
-                success = 0
-                try:
-                    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                        for zip_info in zip_ref.filelist:
-                            for executable in executables[platform_name]:
-                                if zip_info.filename.endswith(executable):
-                                    temp_path = target_dir / "temp"
-                                    temp_path.mkdir(exist_ok=True)
-                                    
-                                    zip_ref.extract(zip_info, temp_path)
-                                    src = temp_path / zip_info.filename
-                                    dst = target_dir / executable
-                                    
-                                    shutil.move(str(src), str(dst))
-                                    
-                                    if platform_name != "windows":
-                                        os.chmod(dst, 0o755)
-                                    
-                                    self._add_path(platform_name, arch, "bento4", executable)
-                                    success += 1
-                                    
-                                    if temp_path.exists():
-                                        shutil.rmtree(temp_path)
+        binaries = []
+        try:
+            with zipfile.ZipFile(buffer, 'r') as archive:
+                for zip_info in archive.infolist():
+                    if zip_info.filename.rsplit('/', 1)[-1] != executable:
+                        continue
                     
-                    zip_path.unlink()
-                except Exception as e:
-                    print(f"  X extract: {str(e)[:40]}")
-                
-                print(f"{success}/4")
+                    with archive.open(zip_info) as src, self._write_binary(dst, target.exe_suffix) as f:
+                        self._copy(src, f)
+                    
+                    binaries.append(executable)
+                    break
+        except Exception as e:
+            errors.append(f"extract: {str(e)[:40]}")
+        
+        return binaries, errors
 
-    def download_megatools(self):
-        print("\n=== Megatools ===")
+    def _download_url(self, targets: list):
+        # One job per unique URL: FFmpeg streams straight to disk, archives are
+        # fetched once and extracted for every target that shares them
+        if targets[0].tool == "ffmpeg":
+            return {target: self.download_ffmpeg(target) for target in targets}
         
-        config = {
-            'windows': {'x64': ('win64', '.zip', 'megatools.exe')},
-            'darwin': {'x64': ('linux-x86_64', '.tar.gz', 'megatools'), 'arm64': ('linux-aarch64', '.tar.gz', 'megatools')},
-            'linux': {'x64': ('linux-x86_64', '.tar.gz', 'megatools'), 'arm64': ('linux-aarch64', '.tar.gz', 'megatools')}
-        }
+        errors = []
+        buffer = self._fetch(targets[0].url, errors=errors)
+        if buffer is None:
+            return {target: ([], errors) for target in targets}
+        
+        extract = self.download_bento4 if targets[0].tool == "bento4" else self.download_megatools
+        results = {}
+        for target in targets:
+            buffer.seek(0)
+            results[target] = extract(target, buffer)
         
+        return results
+
+    def save_paths_json(self):
+        json_path = Path("./binary_paths.json")
+        paths = {key: sorted(rel_paths) for key, rel_paths in self.paths_json.items()}
+        if orjson:
+            data = orjson.dumps(paths, option=orjson.OPT_INDENT_2)
+        else:
+            data = json.dumps(paths, indent=2).encode()
+        
+        json_path.write_bytes(data)
+        print(f"\nPaths: {json_path.absolute()}")
+
+    def _targets(self):
+        # Single source of every download this run can make, in platform order;
+        # each FFmpeg file is its own download, each archive covers all its files
         for platform_name, arches in self.platforms.items():
             for arch in arches:
-                print(f"{platform_name}-{arch}: ", end="", flush=True)
-                
-                if arch not in config[platform_name]:
-                    print("skip")
-                    continue
-                
-                platform_str, extension, executable = config[platform_name][arch]
-                url = f"{MEGATOOLS_URL}/megatools-{MEGATOOLS_VERSION}-{platform_str}{extension}"
+                key = (platform_name, arch)
                 
-                target_dir = self.base_path / platform_name / arch / "megatools"
-                archive_path = target_dir / f"megatools{extension}"
+                if key in FFMPEG_TARGETS:
+                    platform_str, extension, exe_suffix, names = FFMPEG_TARGETS[key]
+                    for name in names:
+                        url = self._ffmpeg_url(name, platform_str, extension)
+                        yield Target("ffmpeg", platform_name, arch, url, extension, exe_suffix, (f"{name}{exe_suffix}",))
                 
-                if not self._download(url, archive_path):
-                    print("0/1")
-                    continue
-                
-                success = 0
-                try:
-                    temp_dir = target_dir / "temp"
-                    temp_dir.mkdir(exist_ok=True)
-                    
-                    if extension == '.zip':
-                        with zipfile.ZipFile(archive_path, 'r') as archive:
-                            archive.extractall(temp_dir)
-                    else:
-                        with tarfile.open(archive_path, 'r:gz') as archive:
-                            archive.extractall(temp_dir)
-                    
-                    for root, dirs, files in os.walk(temp_dir):
-                        if executable in files:
-                            src = Path(root) / executable
-                            dst = target_dir / executable
-                            shutil.move(str(src), str(dst))
-                            
-                            if platform_name != "windows":
-                                os.chmod(dst, 0o755)
-                            
-                            self._add_path(platform_name, arch, "megatools", executable)
-                            success = 1
-                            break
-                    
-                    shutil.rmtree(temp_dir)
-                    archive_path.unlink()
-                except Exception as e:
-                    print(f"  X extract: {str(e)[:40]}")
+                if key in BENTO4_TARGETS:
+                    platform_str, extension, exe_suffix, names = BENTO4_TARGETS[key]
+                    url = self._bento4_url(platform_str, extension)
+                    yield Target("bento4", platform_name, arch, url, extension, exe_suffix,
+                                 tuple(f"{name}{exe_suffix}" for name in names))
                 
-                print(f"{success}/1")
+                if key in MEGATOOLS_TARGETS:
+                    platform_str, extension, exe_suffix, names = MEGATOOLS_TARGETS[key]
+                    url = self._megatools_url(platform_str, extension)
+                    yield Target("megatools", platform_name, arch, url, extension, exe_suffix,
+                                 tuple(f"{name}{exe_suffix}" for name in names))
 
-    def save_paths_json(self):
-        json_path = Path("./binary_paths.json")
-        with open(json_path, 'w') as f:
-            json.dump(self.paths_json, f, indent=2)
-        print(f"\nPaths: {json_path.absolute()}")
+    def _target_dir(self, target: Target) -> Path:
+        return self.base_path / target.platform / target.arch / target.tool
+
+    def _is_cached(self, target: Target) -> bool:
+        target_dir = self._target_dir(target)
+        return all(self._cached(target_dir / executable) for executable in target.executables)
+
+    def _check_url(self, url: str):
+        try:
+            response = self.session.head(url, allow_redirects=True, timeout=15)
+            # Some hosts reject HEAD on GET-only (e.g. signed) URLs; leave
+            # those to the real download rather than failing here
+            if response.status_code not in (403, 405):
+                response.raise_for_status()
+            return None
+        except Exception as e:
+            return f"{url.split('/')[-1]}: {str(e)[:50]}"
 
     def run(self):
         print("Binary Downloader")
         print(f"Base: {self.base_path.absolute()}")
         
-        self.download_ffmpeg()
-        self.download_bento4()
-        self.download_megatools()
+        # Group what still needs fetching by URL so each file is downloaded once
+        targets = list(self._targets())
+        pending = defaultdict(list)
+        for target in targets:
+            if not self._is_cached(target):
+                pending[target.url].append(target)
+        
+        self._stop.clear()
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            try:
+                # Validate every URL up front so a broken release fails in one
+                # round trip instead of after the downloads
+                preflight_errors = [error for error in executor.map(self._check_url, pending) if error]
+                if preflight_errors:
+                    sys.stdout.write("\n=== Pre-flight ===\n" + "".join(f"  X {error}\n" for error in preflight_errors))
+                    sys.exit(1)
+                
+                # Every URL downloads concurrently; results are collected in
+                # platform order so output and paths stay stable.
+                futures = {url: executor.submit(self._download_url, group) for url, group in pending.items()}
+                
+                for title, tool in (("FFmpeg", "ffmpeg"), ("Bento4", "bento4"), ("Megatools", "megatools")):
+                    sys.stdout.write(f"\n=== {title} ===\n")
+                    for platform_name, arches in self.platforms.items():
+                        for arch in arches:
+                            sys.stdout.write(self._report(targets, futures, tool, platform_name, arch))
+            except KeyboardInterrupt:
+                # Drop queued jobs and make running ones stop at their next
+                # chunk, instead of the executor waiting for every download
+                self._stop.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+        
         self.save_paths_json()
         
         print("\nDone!")
 
+    def _report(self, targets: list, futures: dict, tool: str, platform_name: str, arch: str) -> str:
+        mine = [t for t in targets if (t.tool, t.platform, t.arch) == (tool, platform_name, arch)]
+        binaries = []
+        errors = []
+        downloaded = False
+        for target in mine:
+            future = futures.get(target.url)
+            results = future.result() if future else {}
+            if target not in results:
+                # Cached, possibly alongside a target that shares its URL
+                binaries.extend(target.executables)
+                continue
+            
+            target_binaries, target_errors = results[target]
+            binaries.extend(target_binaries)
+            errors.extend(target_errors)
+            downloaded = True
+        
+        for binary in binaries:
+            self._add_path(platform_name, arch, tool, binary)
+        
+        if not mine:
+            status = "skip"
+        elif not downloaded:
+            status = "cached"
+        else:
+            status = f"{len(binaries)}/{sum(len(target.executables) for target in mine)}"
+        
+        # Status and any errors go out as one write per platform/arch
+        parts = [f"{platform_name}-{arch}: {status}"]
+        parts.extend(f"\n  X {error}" for error in errors)
+        parts.append("\n")
+        return "".join(parts)
+
 
 if __name__ == "__main__":
     downloader = BinaryDownloader()